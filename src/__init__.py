@@ -4,10 +4,16 @@ from .core import (
     TemplateMatch,
     TemplateMatcher,
     SimpleTemplateMatcher,
+    AhoCorasickMatcher,
     TemplatePicker,
+    TEMPLATE_BOOKMARKS,
     OpenRouterTemplateMatcher,
+    CoalescingTemplateMatcher,
+    SemanticTemplateCache,
+    EmbeddingStore,
     ImageEditPromptGenerator,
     ImageDownloader,
+    CachedImageDownloader,
     DownloadedImage,
     GeneratedImage,
     MemeImageGenerator,
@@ -21,10 +27,16 @@ __all__ = [
     "TemplateMatch",
     "TemplateMatcher",
     "SimpleTemplateMatcher",
+    "AhoCorasickMatcher",
     "TemplatePicker",
+    "TEMPLATE_BOOKMARKS",
     "OpenRouterTemplateMatcher",
+    "CoalescingTemplateMatcher",
+    "SemanticTemplateCache",
+    "EmbeddingStore",
     "ImageEditPromptGenerator",
     "ImageDownloader",
+    "CachedImageDownloader",
     "DownloadedImage",
     "GeneratedImage",
     "MemeImageGenerator",
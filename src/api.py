@@ -1,30 +1,50 @@
 from __future__ import annotations
 
+import asyncio
+import functools
 import os
 from dataclasses import dataclass
 import logging
 import uuid
 from pathlib import Path
 import sys
-from typing import Optional, List
+from typing import Any, Optional, List, Tuple
 
 from fastapi import FastAPI, File, Form, HTTPException, UploadFile
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 import random
 
+from src.clients import close_session, get_session
 from src.core import (
+    CachedImageDownloader,
     DownloadedImage,
     GeneratedImage,
     ImageDownloader,
     ImageEditPromptGenerator,
     MemeImageGenerator,
     OpenRouterTemplateMatcher,
+    SemanticTemplateCache,
+    TemplateMatch,
     TemplatePicker,
     TemplateRepository,
     SafetyRefusalError,
 )
 
+# Upper bounds on in-flight upstream calls across all requests. Keeps bursts under provider
+# rate limits and caps how many multi-MB base64 payloads are held at once.
+_LLM_SEM = asyncio.Semaphore(16)
+_IMG_GEN_SEM = asyncio.Semaphore(5)
+
+# Largest accepted reference upload; bigger bodies are rejected with 413
+MAX_REF_BYTES = 10 * 1024 * 1024
+
+
+@functools.lru_cache(maxsize=1)
+def _repo() -> TemplateRepository:
+    # Parsed once and shared by the meme service and the background endpoint
+    return TemplateRepository()
+
 
 @dataclass(frozen=True)
 class MemeResult:
@@ -37,13 +57,19 @@ class MemeResult:
 class MemeService:
     _picker: TemplatePicker
     _downloader: ImageDownloader
+    _template_downloader: ImageDownloader
     _prompt_gen: ImageEditPromptGenerator
     _image_gen: MemeImageGenerator
     _logger: logging.Logger
 
     def __init__(self) -> None:
-        self._picker = TemplatePicker(repo=TemplateRepository(), matcher=OpenRouterTemplateMatcher())
+        self._picker = TemplatePicker(
+            repo=_repo(),
+            matcher=SemanticTemplateCache(matcher=OpenRouterTemplateMatcher()),
+        )
         self._downloader = ImageDownloader()
+        # Template blanks are static, so they are served from a local disk cache after first use
+        self._template_downloader = CachedImageDownloader()
         self._prompt_gen = ImageEditPromptGenerator()
         self._image_gen = MemeImageGenerator()
         self._logger = logging.getLogger("ai.memegen")
@@ -57,7 +83,7 @@ class MemeService:
         self._logger.setLevel(logging.INFO)
         self._logger.propagate = False
 
-    def generate_meme(
+    async def generate_meme(
         self,
         description: str,
         reference_file: Optional[UploadFile] = None,
@@ -66,54 +92,60 @@ class MemeService:
         description = (description or "").strip()
         cid = str(uuid.uuid4())
         self._logger.info(
-            f"cid={cid} step=start description_len={len(description)}"
-            f" has_ref_url={bool(reference_url and reference_url.strip())}"
-            f" has_ref_file={bool(reference_file and (reference_file.filename or '').strip())}"
+            "cid=%s step=start description_len=%d has_ref_url=%s has_ref_file=%s",
+            cid,
+            len(description),
+            bool(reference_url and reference_url.strip()),
+            bool(reference_file and (reference_file.filename or "").strip()),
         )
         if not description:
             raise HTTPException(status_code=400, detail="Description is required")
 
-        # Retry template picking once
-        top = None
-        for attempt in range(2):
-            try:
-                self._logger.info(f"cid={cid} step=pick_template attempt={attempt + 1} situation={description!r}")
-                top = self._picker.pick_best(situation=description)
-                if top is not None:
-                    self._logger.info(
-                        f"cid={cid} step=pick_template_success template_id={top.template.id}"
-                        f" template_name={top.template.name!r} score={getattr(top, 'score', 0.0):.3f}"
-                        f" blank_url={top.template.blank}"
-                    )
-                    break
-                if attempt == 1:
-                    raise HTTPException(status_code=500, detail="Failed to select a template")
-            except Exception as e:
-                self._logger.warning(f"cid={cid} step=pick_template_error attempt={attempt + 1} error={e!r}")
-                if attempt == 1:
-                    raise HTTPException(status_code=500, detail=f"Failed to select a template: {e}")
-                continue
-        if top is None:
-            raise HTTPException(status_code=500, detail="Failed to select a template")
-
-        template = top.template
-        self._logger.info(f"cid={cid} step=download_template_image url={template.blank}")
-        template_image = self._downloader.download(template.blank)
-        self._logger.info(
-            f"cid={cid} step=template_image_ready mime={template_image.mime_type} size={len(template_image.content)}"
-        )
-
         if reference_file is not None:
             self._logger.info(
-                f"cid={cid} step=reference_upload_received filename={reference_file.filename!r}"
-                f" content_type={reference_file.content_type!r}"
+                "cid=%s step=reference_upload_received filename=%r content_type=%r",
+                cid,
+                reference_file.filename,
+                reference_file.content_type,
             )
+            # Reject declared oversize uploads before any template work starts
+            if reference_file.size and reference_file.size > MAX_REF_BYTES:
+                await reference_file.close()
+                raise HTTPException(status_code=413, detail="Reference image too large")
         if reference_url is not None and reference_url.strip():
-            self._logger.info(f"cid={cid} step=reference_url_received url={reference_url.strip()}")
-        ref_img = self._build_reference_image(reference_file=reference_file, reference_url=reference_url)
+            self._logger.info("cid=%s step=reference_url_received url=%s", cid, reference_url.strip())
+        # The reference image doesn't depend on the template; fetch it while the template is picked
+        ref_task = asyncio.create_task(
+            self._build_reference_image(reference_file=reference_file, reference_url=reference_url)
+        )
+        ref_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+        try:
+            top = await self._pick_template(cid, description)
+        except BaseException:
+            ref_task.cancel()
+            raise
+
+        template = top.template
+        self._logger.info("cid=%s step=download_template_image url=%s", cid, template.blank)
+
+        try:
+            template_image, ref_img = await asyncio.gather(self._template_downloader.download(template.blank), ref_task)
+        except BaseException:
+            ref_task.cancel()
+            raise
+        self._logger.info(
+            "cid=%s step=template_image_ready mime=%s size=%d",
+            cid,
+            template_image.mime_type,
+            len(template_image.content),
+        )
         if ref_img is not None:
             self._logger.info(
-                f"cid={cid} step=reference_image_ready mime={ref_img.mime_type} size={len(ref_img.content)}"
+                "cid=%s step=reference_image_ready mime=%s size=%d",
+                cid,
+                ref_img.mime_type,
+                len(ref_img.content),
             )
 
         # Retry prompt creation once
@@ -121,91 +153,132 @@ class MemeService:
         for attempt in range(2):
             try:
                 self._logger.info(
-                    f"cid={cid} step=create_prompt attempt={attempt + 1} template_id={template.id}"
-                    f" has_template_image=True has_reference_image={bool(ref_img is not None)}"
+                    "cid=%s step=create_prompt attempt=%s template_id=%s has_template_image=True "
+                    "has_reference_image=%s",
+                    cid,
+                    attempt + 1,
+                    template.id,
+                    bool(ref_img is not None),
                 )
-                prompt = self._prompt_gen.create_prompt(
+                prompt = await self._create_prompt(
                     user_description=description,
                     template=template,
                     template_image=template_image,
                     reference_image=ref_img,
                 )
-                self._logger.info(f"cid={cid} step=create_prompt_success prompt={prompt!r}")
+                self._logger.info("cid=%s step=create_prompt_success prompt=%r", cid, prompt)
                 break
             except Exception as e:
-                self._logger.warning(f"cid={cid} step=create_prompt_error attempt={attempt + 1} error={e!r}")
+                self._logger.warning("cid=%s step=create_prompt_error attempt=%s error=%r", cid, attempt + 1, e)
                 if attempt == 1:
                     raise HTTPException(status_code=500, detail=f"Failed to create prompt: {e}")
                 continue
 
         # Image generation with safety-aware fallback
         generated: Optional[GeneratedImage] = None
-        for attempt in range(2):
-            try:
-                self._logger.info(
-                    f"cid={cid} step=generate_image attempt={attempt + 1}"
-                    f" prompt_len={len(prompt)} has_ref_image={bool(ref_img is not None)}"
-                )
-                generated = self._image_gen.generate(
-                    prompt=prompt,
+        # Refusals mostly come from identity matching against a reference image. When one is
+        # attached, prepare the softened prompt while the first generation attempt runs so a
+        # refusal only costs the retry itself.
+        soft_prompt_task: Optional[asyncio.Task[str]] = None
+        if ref_img is not None:
+            soft_prompt_task = asyncio.create_task(
+                self._create_prompt(
+                    user_description=description,
+                    template=template,
                     template_image=template_image,
                     reference_image=ref_img,
+                    safety_soften=True,
                 )
-                self._logger.info(
-                    f"cid={cid} step=generate_image_success mime={generated.mime_type} size={len(generated.content)}"
-                )
-                break
-            except SafetyRefusalError as e:
-                self._logger.warning(f"cid={cid} step=generate_image_refused attempt={attempt + 1} error={e!r}")
-                # Safety fallback: regenerate a softened prompt and retry once
-                try:
-                    self._logger.info(
-                        f"cid={cid} step=create_prompt_soft attempt=1 template_id={template.id}"
-                        f" has_template_image=True has_reference_image={bool(ref_img is not None)}"
-                    )
-                    soft_prompt = self._prompt_gen.create_prompt(
-                        user_description=description,
-                        template=template,
-                        template_image=template_image,
-                        reference_image=ref_img,
-                        safety_soften=True,
-                    )
-                    self._logger.info(f"cid={cid} step=create_prompt_soft_success prompt={soft_prompt!r}")
-                except Exception as e2:
-                    self._logger.warning(f"cid={cid} step=create_prompt_soft_error attempt=1 error={e2!r}")
-                    # If we fail to create a soft prompt, surface original safety refusal
-                    raise e
-
+            )
+            # Mark failures as retrieved; they only matter if the task is awaited on refusal
+            soft_prompt_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        try:
+            for attempt in range(2):
                 try:
                     self._logger.info(
-                        f"cid={cid} step=generate_image_soft attempt=1 prompt_len={len(soft_prompt)}"
-                        f" has_ref_image={bool(ref_img is not None)}"
+                        "cid=%s step=generate_image attempt=%s prompt_len=%d has_ref_image=%s",
+                        cid,
+                        attempt + 1,
+                        len(prompt),
+                        bool(ref_img is not None),
                     )
-                    generated = self._image_gen.generate(
-                        prompt=soft_prompt,
+                    generated = await self._generate_image(
+                        prompt=prompt,
                         template_image=template_image,
                         reference_image=ref_img,
                     )
                     self._logger.info(
-                        f"cid={cid} step=generate_image_soft_success mime={generated.mime_type} size={len(generated.content)}"
+                        "cid=%s step=generate_image_success mime=%s size=%d",
+                        cid,
+                        generated.mime_type,
+                        len(generated.content),
                     )
-                    # Expose the softened prompt in result
-                    prompt = soft_prompt
                     break
-                except SafetyRefusalError as e_soft:
-                    self._logger.warning(f"cid={cid} step=generate_image_soft_refused attempt=1 error={e_soft!r}")
-                    raise e_soft
-                except Exception as e_soft:
-                    self._logger.warning(f"cid={cid} step=generate_image_soft_error attempt=1 error={e_soft!r}")
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"Failed to generate image after safety fallback: {e_soft}",
-                    )
-            except Exception as e:
-                self._logger.warning(f"cid={cid} step=generate_image_error attempt={attempt + 1} error={e!r}")
-                if attempt == 1:
-                    raise HTTPException(status_code=500, detail=f"Failed to generate image: {e}")
-                continue
+                except SafetyRefusalError as e:
+                    self._logger.warning("cid=%s step=generate_image_refused attempt=%s error=%r", cid, attempt + 1, e)
+                    # Safety fallback: regenerate a softened prompt and retry once
+                    try:
+                        self._logger.info(
+                            "cid=%s step=create_prompt_soft attempt=1 template_id=%s has_template_image=True "
+                            "has_reference_image=%s",
+                            cid,
+                            template.id,
+                            bool(ref_img is not None),
+                        )
+                        if soft_prompt_task is not None:
+                            soft_prompt = await soft_prompt_task
+                        else:
+                            soft_prompt = await self._create_prompt(
+                                user_description=description,
+                                template=template,
+                                template_image=template_image,
+                                reference_image=ref_img,
+                                safety_soften=True,
+                            )
+                        self._logger.info("cid=%s step=create_prompt_soft_success prompt=%r", cid, soft_prompt)
+                    except Exception as e2:
+                        self._logger.warning("cid=%s step=create_prompt_soft_error attempt=1 error=%r", cid, e2)
+                        # If we fail to create a soft prompt, surface original safety refusal
+                        raise e
+
+                    try:
+                        self._logger.info(
+                            "cid=%s step=generate_image_soft attempt=1 prompt_len=%d has_ref_image=%s",
+                            cid,
+                            len(soft_prompt),
+                            bool(ref_img is not None),
+                        )
+                        generated = await self._generate_image(
+                            prompt=soft_prompt,
+                            template_image=template_image,
+                            reference_image=ref_img,
+                        )
+                        self._logger.info(
+                            "cid=%s step=generate_image_soft_success mime=%s size=%d",
+                            cid,
+                            generated.mime_type,
+                            len(generated.content),
+                        )
+                        # Expose the softened prompt in result
+                        prompt = soft_prompt
+                        break
+                    except SafetyRefusalError as e_soft:
+                        self._logger.warning("cid=%s step=generate_image_soft_refused attempt=1 error=%r", cid, e_soft)
+                        raise e_soft
+                    except Exception as e_soft:
+                        self._logger.warning("cid=%s step=generate_image_soft_error attempt=1 error=%r", cid, e_soft)
+                        raise HTTPException(
+                            status_code=500,
+                            detail=f"Failed to generate image after safety fallback: {e_soft}",
+                        )
+                except Exception as e:
+                    self._logger.warning("cid=%s step=generate_image_error attempt=%s error=%r", cid, attempt + 1, e)
+                    if attempt == 1:
+                        raise HTTPException(status_code=500, detail=f"Failed to generate image: {e}")
+                    continue
+        finally:
+            if soft_prompt_task is not None:
+                soft_prompt_task.cancel()
 
         if generated is None:
             raise HTTPException(status_code=500, detail="Image generation returned no result")
@@ -217,7 +290,43 @@ class MemeService:
             prompt=prompt,
         )
 
-    def _build_reference_image(
+    async def _pick_template(self, cid: str, description: str) -> TemplateMatch:
+        # Retry template picking once
+        top = None
+        for attempt in range(2):
+            try:
+                self._logger.info("cid=%s step=pick_template attempt=%s situation=%r", cid, attempt + 1, description)
+                top = await self._picker.pick_best(situation=description)
+                if top is not None:
+                    self._logger.info(
+                        "cid=%s step=pick_template_success template_id=%s template_name=%r score=%.3f blank_url=%s",
+                        cid,
+                        top.template.id,
+                        top.template.name,
+                        getattr(top, "score", 0.0),
+                        top.template.blank,
+                    )
+                    break
+                if attempt == 1:
+                    raise HTTPException(status_code=500, detail="Failed to select a template")
+            except Exception as e:
+                self._logger.warning("cid=%s step=pick_template_error attempt=%s error=%r", cid, attempt + 1, e)
+                if attempt == 1:
+                    raise HTTPException(status_code=500, detail=f"Failed to select a template: {e}")
+                continue
+        if top is None:
+            raise HTTPException(status_code=500, detail="Failed to select a template")
+        return top
+
+    async def _create_prompt(self, **kwargs: Any) -> str:
+        async with _LLM_SEM:
+            return await self._prompt_gen.create_prompt(**kwargs)
+
+    async def _generate_image(self, **kwargs: Any) -> GeneratedImage:
+        async with _IMG_GEN_SEM:
+            return await self._image_gen.generate(**kwargs)
+
+    async def _build_reference_image(
         self, reference_file: Optional[UploadFile] = None, reference_url: Optional[str] = None
     ) -> Optional[DownloadedImage]:
         if reference_file is not None:
@@ -225,25 +334,37 @@ class MemeService:
                 filename = (reference_file.filename or "").strip()
                 if not filename:
                     return None
-                pos = reference_file.file.tell()
-                first = reference_file.file.read(1)
-                reference_file.file.seek(pos)
-                if not first:
+                content = await self._read_reference_upload(reference_file)
+                if not content:
                     return None
-                return self._build_reference_image_from_upload(reference_file)
+                return DownloadedImage(
+                    url=reference_file.filename or "upload",
+                    content=content,
+                    mime_type=reference_file.content_type or "image/png",
+                )
+            except HTTPException:
+                raise
             except Exception:
                 return None
         if reference_url and reference_url.strip():
-            return self._build_reference_image_from_url(reference_url.strip())
+            return await self._build_reference_image_from_url(reference_url.strip())
         return None
 
-    def _build_reference_image_from_upload(self, file: UploadFile) -> DownloadedImage:
-        content = file.file.read()
-        mime = file.content_type or "image/png"
-        return DownloadedImage(url=file.filename or "upload", content=content, mime_type=mime)
+    async def _read_reference_upload(self, reference_file: UploadFile) -> bytes:
+        try:
+            # Declared sizes are checked up front in generate_meme; this catches undeclared ones
+            buf = bytearray()
+            while chunk := await reference_file.read(1 << 16):
+                buf.extend(chunk)
+                if len(buf) > MAX_REF_BYTES:
+                    raise HTTPException(status_code=413, detail="Reference image too large")
+            return bytes(buf)
+        finally:
+            # Release the spooled copy now instead of holding it for the whole generation
+            await reference_file.close()
 
-    def _build_reference_image_from_url(self, url: str) -> DownloadedImage:
-        return self._downloader.download(url)
+    async def _build_reference_image_from_url(self, url: str) -> DownloadedImage:
+        return await self._downloader.download(url)
 
 
 app = FastAPI(title="AI MemeGen API", version="0.1.0")
@@ -257,14 +378,25 @@ if _STATIC_DIR.exists():
     app.mount("/static", StaticFiles(directory=str(_STATIC_DIR)), name="static")
 
 
+@app.on_event("startup")
+async def open_http_session() -> None:
+    # Shared connection pool for all outbound LLM and image requests
+    get_session()
+
+
+@app.on_event("shutdown")
+async def close_http_session() -> None:
+    await close_session()
+
+
 @app.post("/meme")
-def create_meme(
+async def create_meme(
     description: str = Form(...),
     reference_url: Optional[str] = Form(None),
     reference_file: Optional[UploadFile] = File(None),
 ):
     try:
-        result = _service.generate_meme(
+        result = await _service.generate_meme(
             description=description, reference_file=reference_file, reference_url=reference_url
         )
         payload = {
@@ -273,7 +405,7 @@ def create_meme(
             "template_id": result.template_id,
             "template_name": result.template_name,
         }
-        return JSONResponse(content=payload)
+        return ORJSONResponse(content=payload)
     except HTTPException:
         raise
     except SafetyRefusalError as e:
@@ -290,18 +422,22 @@ async def index() -> FileResponse:
     return FileResponse(str(index_path))
 
 
+@functools.lru_cache(maxsize=1)
+def _background_candidates() -> Tuple[str, ...]:
+    return tuple(t.blank for t in _repo().all_unique() if t.blank)
+
+
 @app.get("/memes/background")
-async def get_background_memes(count: int = 60) -> JSONResponse:
+async def get_background_memes(count: int = 60) -> ORJSONResponse:
     """Return a list of random meme template image URLs for background tiles."""
     try:
-        repo = TemplateRepository()
-        candidates = [t.blank for t in repo.all_unique() if t.blank]
+        candidates = _background_candidates()
         if not candidates:
-            return JSONResponse(content={"images": []})
+            return ORJSONResponse(content={"images": []})
         k = max(0, min(int(count), len(candidates)))
         # If k == len(candidates), sample returns a permuted copy; otherwise random sample
         images: List[str] = random.sample(candidates, k)
-        return JSONResponse(content={"images": images})
+        return ORJSONResponse(content={"images": images})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1,12 +1,169 @@
 from __future__ import annotations
 
+import asyncio
+import functools
 import os
-from typing import Any, Dict, List, Optional, Tuple
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
-import requests
+import aiohttp
+import orjson
+
+try:
+    import pybase64 as base64
+except ImportError:  # optional: SIMD base64 for multi-MB image payloads
+    import base64
+
+_SESSION: Optional[aiohttp.ClientSession] = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Return the process-wide HTTP session, creating it on first use.
+
+    Must be called from within a running event loop.
+    """
+    global _SESSION
+    if _SESSION is None or _SESSION.closed:
+        _SESSION = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=64, limit_per_host=16))
+    return _SESSION
+
+
+async def close_session() -> None:
+    global _SESSION
+    if _SESSION is not None and not _SESSION.closed:
+        await _SESSION.close()
+    _SESSION = None
+
+
+async def _warm_connection(url: str, timeout: float = 3.0) -> None:
+    # Opens a pooled keep-alive connection to url's host; on failure the next real request pays the handshake
+    try:
+        async with get_session().head(url, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+            await resp.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        pass
+
+
+_RETRIES = 2
+# Inputs per embedding request; stays under Google's 100-per-batch limit
+_EMBED_BATCH = 96
+_RETRY_BACKOFF = 0.2
+
+
+async def _embed_in_chunks(
+    embed_chunk: Callable[[List[str], Optional[str]], Awaitable[List[List[float]]]],
+    texts: List[str],
+    model: Optional[str],
+) -> List[List[float]]:
+    # One request per _EMBED_BATCH texts, sent concurrently; results keep the input order
+    if not texts:
+        return []
+    if len(texts) <= _EMBED_BATCH:
+        return await embed_chunk(texts, model)
+    chunks = [texts[i : i + _EMBED_BATCH] for i in range(0, len(texts), _EMBED_BATCH)]
+    results = await asyncio.gather(*(embed_chunk(chunk, model) for chunk in chunks))
+    return [vector for result in results for vector in result]
+
+
+class InlineImage:
+    """Image attachment usable as an ``image_url`` url in chat messages.
+
+    The base64 text is produced only when a request body is built: Google requests embed it
+    directly and OpenRouter requests get a data URI from the JSON encoder. Deliberately not a
+    dataclass, which orjson would serialize field by field.
+    """
+
+    __slots__ = ("mime_type", "content", "_b64")
+
+    mime_type: str
+    content: bytes
+    _b64: Optional[str]
+
+    def __init__(self, mime_type: str, content: bytes) -> None:
+        self.mime_type = mime_type
+        self.content = content
+        self._b64 = None
+
+    @property
+    def b64(self) -> str:
+        if self._b64 is None:
+            self._b64 = base64.b64encode(memoryview(self.content)).decode("ascii")
+        return self._b64
+
+    def data_uri(self) -> str:
+        return f"data:{self.mime_type};base64,{self.b64}"
+
+
+def _json_default(obj: Any) -> Any:
+    if isinstance(obj, InlineImage):
+        return obj.data_uri()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+async def _post_json(
+    url: str, headers: Dict[str, str], body: Dict[str, Any], timeout: float, retry_disconnects: bool = False
+) -> Any:
+    """POST a JSON body on the shared session and return the decoded JSON response.
+
+    Failures to connect are retried with exponential backoff; HTTP error statuses are raised
+    immediately. A dropped connection may mean the server already received the request, so it
+    is only retried when retry_disconnects is set by callers whose request is safe to repeat.
+    """
+    retryable = (
+        (aiohttp.ClientConnectorError, aiohttp.ServerDisconnectedError)
+        if retry_disconnects
+        else (aiohttp.ClientConnectorError,)
+    )
+    for attempt in range(_RETRIES + 1):
+        try:
+            async with get_session().post(
+                url,
+                headers=headers,
+                data=orjson.dumps(body, default=_json_default),
+                timeout=aiohttp.ClientTimeout(total=timeout),
+            ) as resp:
+                resp.raise_for_status()
+                return orjson.loads(await resp.read())
+        except retryable:
+            if attempt == _RETRIES:
+                raise
+            await asyncio.sleep(_RETRY_BACKOFF * (2**attempt))
+
+
+_RETRY_STATUSES = frozenset({502, 503, 504})
+
+
+async def fetch_bytes(url: str, timeout: float) -> Tuple[bytes, str]:
+    """GET a URL on the shared session and return its body and bare content type.
+
+    A GET is safe to repeat, so connection failures, resets, timeouts, truncated bodies and
+    502/503/504 responses are retried with the same backoff as JSON requests; other HTTP error
+    statuses are raised immediately.
+    """
+    for attempt in range(_RETRIES + 1):
+        try:
+            async with get_session().get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                if resp.status in _RETRY_STATUSES and attempt < _RETRIES:
+                    await asyncio.sleep(_RETRY_BACKOFF * (2**attempt))
+                    continue
+                resp.raise_for_status()
+                content_type = resp.headers.get("Content-Type", "").split(";")[0].strip()
+                return await resp.read(), content_type
+        except (
+            aiohttp.ClientOSError,
+            aiohttp.ServerDisconnectedError,
+            aiohttp.ClientPayloadError,
+            asyncio.TimeoutError,
+        ):
+            if attempt == _RETRIES:
+                raise
+            await asyncio.sleep(_RETRY_BACKOFF * (2**attempt))
+    raise RuntimeError(f"Failed to download {url}")
 
 
 class OpenRouterClient:
+    DEFAULT_EMBEDDING_MODEL = "openai/text-embedding-3-small"
+
     _api_key: str
     _base_url: str
     _timeout: float
@@ -23,65 +180,110 @@ class OpenRouterClient:
         self._base_url = base_url.rstrip("/")
         self._timeout = timeout
 
-    def chat(
+    async def warm_up(self) -> None:
+        await _warm_connection(self._base_url)
+
+    async def chat(
         self,
         messages: List[Dict[str, Any]],
         model: str,
         temperature: float = 0.2,
         max_tokens: int = 512,
     ) -> str:
-        url = f"{self._base_url}/chat/completions"
-        headers = self._build_headers()
-        body = {
-            "model": model,
-            "messages": messages,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-        }
-        resp = requests.post(url, headers=headers, json=body, timeout=self._timeout)
-        resp.raise_for_status()
-        data = resp.json()
-        content: str = ""
-        try:
-            content = data["choices"][0]["message"]["content"]
-        except Exception:
-            if isinstance(data, dict) and "choices" in data and data["choices"]:
-                first = data["choices"][0]
-                if isinstance(first, dict):
-                    msg = first.get("message") or {}
-                    content = str(msg.get("content", ""))
-        return content
-
-    def chat_raw(
+        data = await self._post(messages, model, temperature, max_tokens, retry_disconnects=True)
+        return self._extract_content(data)
+
+    async def chat_raw(
         self,
         messages: List[Dict[str, Any]],
         model: str,
         temperature: float = 0.2,
         max_tokens: int = 1024,
     ) -> Dict[str, Any]:
-        url = f"{self._base_url}/chat/completions"
+        data = await self._post(messages, model, temperature, max_tokens)
+        if not isinstance(data, dict):
+            raise RuntimeError("Unexpected response format from OpenRouter")
+        return data
+
+    async def embed(self, texts: List[str], model: Optional[str] = None) -> List[List[float]]:
+        return await _embed_in_chunks(self._embed_chunk, texts, model)
+
+    async def _embed_chunk(self, texts: List[str], model: Optional[str]) -> List[List[float]]:
+        url = f"{self._base_url}/embeddings"
         headers = self._build_headers()
+        body = {"model": model or self.DEFAULT_EMBEDDING_MODEL, "input": texts}
+        data = await _post_json(url, headers, body, self._timeout, retry_disconnects=True)
+        items = sorted(data.get("data") or [], key=lambda x: x.get("index", 0))
+        return [list(item.get("embedding") or []) for item in items]
+
+    async def _post(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        retry_disconnects: bool = False,
+    ) -> Any:
+        url = f"{self._base_url}/chat/completions"
         body = {
             "model": model,
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens,
         }
-        resp = requests.post(url, headers=headers, json=body, timeout=self._timeout)
-        resp.raise_for_status()
-        data = resp.json()
+        return await _post_json(url, self._build_headers(), body, self._timeout, retry_disconnects)
+
+    def _extract_content(self, data: Any) -> str:
         if not isinstance(data, dict):
-            raise RuntimeError("Unexpected response format from OpenRouter")
-        return data
+            return ""
+        choices = data.get("choices") or []
+        first = choices[0] if choices and isinstance(choices[0], dict) else {}
+        msg = first.get("message") or {}
+        return str(msg.get("content") or "")
 
     def _build_headers(self) -> Dict[str, str]:
         return {
             "Authorization": f"Bearer {self._api_key}",
             "Content-Type": "application/json",
+            "Connection": "keep-alive",
         }
 
 
+# Google response part keys that carry an image (camelCase and snake_case variants),
+# mapped to their (mime type field, payload field)
+_GOOGLE_IMAGE_PART_FIELDS: Dict[str, Tuple[str, str]] = {
+    "inlineData": ("mimeType", "data"),
+    "inline_data": ("mime_type", "data"),
+    "fileData": ("mimeType", "fileUri"),
+    "file_data": ("mime_type", "file_uri"),
+}
+_GOOGLE_INLINE_PART_KEYS = frozenset({"inlineData", "inline_data"})
+
+
+@functools.lru_cache(maxsize=64)
+def _normalize_google_model(model: str) -> str:
+    # Accept OpenRouter-style ids and map to Google format
+    # e.g., "google/gemini-2.5-flash-image-preview:free" -> "models/gemini-2.5-flash-image-preview"
+    m = model
+    if "/" in m:
+        parts = m.split("/", 1)[1]
+        m = parts
+    if ":" in m:
+        m = m.split(":", 1)[0]
+    if not m.startswith("models/"):
+        m = f"models/{m}"
+    return m
+
+
+@functools.lru_cache(maxsize=64)
+def _google_endpoint(base_url: str, model: str, method: str) -> str:
+    # API key is appended by the caller so it never lands in the cache
+    return f"{base_url}/{_normalize_google_model(model)}:{method}"
+
+
 class GoogleClient:
+    DEFAULT_EMBEDDING_MODEL = "google/text-embedding-004"
+
     _api_key: str
     _base_url: str
     _timeout: float
@@ -98,32 +300,20 @@ class GoogleClient:
         self._base_url = base_url.rstrip("/")
         self._timeout = timeout
 
+    async def warm_up(self) -> None:
+        await _warm_connection(self._base_url)
+
     def _normalize_model(self, model: str) -> str:
-        # Accept OpenRouter-style ids and map to Google format
-        # e.g., "google/gemini-2.5-flash-image-preview:free" -> "models/gemini-2.5-flash-image-preview"
-        m = model
-        if "/" in m:
-            parts = m.split("/", 1)[1]
-            m = parts
-        if ":" in m:
-            m = m.split(":", 1)[0]
-        if not m.startswith("models/"):
-            m = f"models/{m}"
-        return m
-
-    def chat(
+        return _normalize_google_model(model)
+
+    async def chat(
         self,
         messages: List[Dict[str, Any]],
         model: str,
         temperature: float = 0.2,
         max_tokens: int = 512,
     ) -> str:
-        url = f"{self._base_url}/{self._normalize_model(model)}:generateContent?key={self._api_key}"
-        headers = {"Content-Type": "application/json"}
-        body = self._convert_messages_to_google_payload(messages, temperature, max_tokens)
-        resp = requests.post(url, headers=headers, json=body, timeout=self._timeout)
-        resp.raise_for_status()
-        data = resp.json()
+        data = await self._post(messages, model, temperature, max_tokens, retry_disconnects=True)
         # Extract first text part
         try:
             cands = data.get("candidates") or []
@@ -136,23 +326,43 @@ class GoogleClient:
             pass
         return ""
 
-    def chat_raw(
+    async def chat_raw(
         self,
         messages: List[Dict[str, Any]],
         model: str,
         temperature: float = 0.2,
         max_tokens: int = 1024,
     ) -> Dict[str, Any]:
-        url = f"{self._base_url}/{self._normalize_model(model)}:generateContent?key={self._api_key}"
-        headers = {"Content-Type": "application/json"}
-        body = self._convert_messages_to_google_payload(messages, temperature, max_tokens)
-        resp = requests.post(url, headers=headers, json=body, timeout=self._timeout)
-        resp.raise_for_status()
-        data = resp.json()
+        data = await self._post(messages, model, temperature, max_tokens)
         # Convert Google response to OpenRouter-like structure our parser expects
         converted = self._convert_google_to_openrouter_like(data)
         return converted
 
+    async def embed(self, texts: List[str], model: Optional[str] = None) -> List[List[float]]:
+        return await _embed_in_chunks(self._embed_chunk, texts, model)
+
+    async def _embed_chunk(self, texts: List[str], model: Optional[str]) -> List[List[float]]:
+        model_name = self._normalize_model(model or self.DEFAULT_EMBEDDING_MODEL)
+        url = f"{_google_endpoint(self._base_url, model_name, 'batchEmbedContents')}?key={self._api_key}"
+        body = {"requests": [{"model": model_name, "content": {"parts": [{"text": t}]}} for t in texts]}
+        data = await _post_json(url, self._build_headers(), body, self._timeout, retry_disconnects=True)
+        return [list((e or {}).get("values") or []) for e in data.get("embeddings") or []]
+
+    async def _post(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        retry_disconnects: bool = False,
+    ) -> Any:
+        url = f"{_google_endpoint(self._base_url, model, 'generateContent')}?key={self._api_key}"
+        body = self._convert_messages_to_google_payload(messages, temperature, max_tokens)
+        return await _post_json(url, self._build_headers(), body, self._timeout, retry_disconnects)
+
+    def _build_headers(self) -> Dict[str, str]:
+        return {"Content-Type": "application/json", "Connection": "keep-alive"}
+
     def _convert_messages_to_google_payload(
         self, messages: List[Dict[str, Any]], temperature: float, max_tokens: int
     ) -> Dict[str, Any]:
@@ -184,6 +394,17 @@ class GoogleClient:
                         parts.append({"text": str(item.get("text") or "")})
                     elif item.get("type") == "image_url":
                         image_url = (item.get("image_url") or {}).get("url")
+                        if isinstance(image_url, InlineImage):
+                            # Already-encoded base64 is used as is, no data URI round trip
+                            parts.append(
+                                {
+                                    "inline_data": {
+                                        "mime_type": image_url.mime_type or "image/png",
+                                        "data": image_url.b64,
+                                    }
+                                }
+                            )
+                            continue
                         mime, b64 = self._parse_data_uri(str(image_url or ""))
                         if b64:
                             parts.append({"inline_data": {"mime_type": mime or "image/png", "data": b64}})
@@ -218,6 +439,24 @@ class GoogleClient:
         except Exception:
             return "image/png", ""
 
+    def _convert_image_part(self, key: str, spec: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        mime_field, payload_field = _GOOGLE_IMAGE_PART_FIELDS[key]
+        mime = str(spec.get(mime_field) or "image/png")
+        if key in _GOOGLE_INLINE_PART_KEYS:
+            # Decoded here once instead of re-wrapping as a data URI
+            return self._decode_inline_image(mime, spec.get(payload_field))
+        uri = str(spec.get(payload_field) or "")
+        return {"image_url": {"url": uri}} if uri else None
+
+    def _decode_inline_image(self, mime: str, b64: Any) -> Optional[Dict[str, Any]]:
+        if not isinstance(b64, str) or not b64:
+            return None
+        try:
+            payload = base64.b64decode(b64)
+        except ValueError:
+            return None
+        return {"image_bytes": payload, "mime_type": mime}
+
     def _convert_google_to_openrouter_like(self, data: Dict[str, Any]) -> Dict[str, Any]:
         # Detect safety / refusal
         refusal: Optional[str] = None
@@ -259,37 +498,16 @@ class GoogleClient:
             for p in parts:
                 if not isinstance(p, dict):
                     continue
-                # inlineData (camelCase)
-                if "inlineData" in p:
-                    inline = p.get("inlineData") or {}
-                    mime = str(inline.get("mimeType") or "image/png")
-                    b64 = str(inline.get("data") or "")
-                    if b64:
-                        images.append({"image_url": {"url": f"data:{mime};base64,{b64}"}})
-                        continue
-                # inline_data (snake_case) - just in case
-                if "inline_data" in p:
-                    inline = p.get("inline_data") or {}
-                    mime = str(inline.get("mime_type") or "image/png")
-                    b64 = str(inline.get("data") or "")
-                    if b64:
-                        images.append({"image_url": {"url": f"data:{mime};base64,{b64}"}})
-                        continue
-                # fileData with fileUri
-                if "fileData" in p:
-                    fd = p.get("fileData") or {}
-                    mime = str(fd.get("mimeType") or "image/png")
-                    uri = str(fd.get("fileUri") or "")
-                    if uri:
-                        images.append({"image_url": {"url": uri}})
-                        continue
-                if "file_data" in p:
-                    fd = p.get("file_data") or {}
-                    mime = str(fd.get("mime_type") or "image/png")
-                    uri = str(fd.get("file_uri") or "")
-                    if uri:
-                        images.append({"image_url": {"url": uri}})
-                        continue
+                # Image keys are tried in declaration order; an empty payload falls through to the next one
+                image = None
+                for image_key in _GOOGLE_IMAGE_PART_FIELDS:
+                    if image_key in p:
+                        image = self._convert_image_part(image_key, p.get(image_key) or {})
+                        if image is not None:
+                            break
+                if image is not None:
+                    images.append(image)
+                    continue
                 # Text parts (often contain refusal/explanations)
                 if "text" in p and isinstance(p.get("text"), str):
                     t = str(p.get("text") or "").strip()
@@ -323,3 +541,32 @@ class GoogleClient:
         }
 
         return data
+
+
+_CLIENT_LOCK = threading.Lock()
+_OPENROUTER_CLIENT: Optional[OpenRouterClient] = None
+_GOOGLE_CLIENT: Optional[GoogleClient] = None
+
+
+def get_openrouter_client() -> OpenRouterClient:
+    """Return the process-wide OpenRouter client, created from the environment on first use."""
+    global _OPENROUTER_CLIENT
+    client = _OPENROUTER_CLIENT
+    if client is None:
+        with _CLIENT_LOCK:
+            if _OPENROUTER_CLIENT is None:
+                _OPENROUTER_CLIENT = OpenRouterClient()
+            client = _OPENROUTER_CLIENT
+    return client
+
+
+def get_google_client() -> GoogleClient:
+    """Return the process-wide Google client, created from the environment on first use."""
+    global _GOOGLE_CLIENT
+    client = _GOOGLE_CLIENT
+    if client is None:
+        with _CLIENT_LOCK:
+            if _GOOGLE_CLIENT is None:
+                _GOOGLE_CLIENT = GoogleClient()
+            client = _GOOGLE_CLIENT
+    return client
@@ -1,18 +1,42 @@
 from __future__ import annotations
 
+import asyncio
+import functools
+import heapq
+import itertools
 import json
 import random
-from dataclasses import dataclass
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import hashlib
 import os
 import logging
+import sqlite3
+import threading
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional, Tuple
-import base64
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 import mimetypes
-import requests
+import tempfile
+from urllib.parse import urlsplit
 
+import numpy as np
+import orjson
 
-@dataclass(frozen=True)
+from .clients import InlineImage, fetch_bytes, get_google_client, get_openrouter_client
+
+try:
+    import pybase64 as base64
+except ImportError:  # optional: SIMD base64 for multi-MB image payloads
+    import base64
+
+try:
+    import ahocorasick
+except ImportError:  # optional: AhoCorasickMatcher falls back to substring scans
+    ahocorasick = None
+
+
+@dataclass(frozen=True, slots=True)
 class MemeTemplate:
     id: str
     name: str
@@ -24,64 +48,109 @@ class MemeTemplate:
     source: Optional[str]
     keywords: List[str]
     self_url: str
+    # Lowercased once at load time so matchers don't redo it on every rank
+    keywords_lc: Tuple[str, ...] = field(init=False, repr=False, compare=False)
+    name_tokens_lc: Tuple[str, ...] = field(init=False, repr=False, compare=False)
+    # {"id", "name"} as serialized into LLM ranking prompts
+    prompt_json: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "keywords_lc", tuple(kw.lower() for kw in self.keywords if kw))
+        object.__setattr__(self, "name_tokens_lc", tuple(self.name.lower().split()))
+        object.__setattr__(self, "prompt_json", orjson.dumps({"id": self.id, "name": self.name}).decode("utf-8"))
+
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+# MEMEGEN_PROVIDER=openrouter selects OpenRouter; Google is the default. Read once at import.
+_USE_OPENROUTER = os.getenv("MEMEGEN_PROVIDER", "").strip().strip("\"'").lower().startswith("openrouter")
+
+
+def _default_client() -> Any:
+    # Shared per process so every matcher and generator reuses one configured client
+    return get_openrouter_client() if _USE_OPENROUTER else get_google_client()
+
+
+# Parsed template lists keyed by (resolved path, mtime_ns); MemeTemplate is frozen so lists are shared
+_TEMPLATE_CACHE: Dict[Tuple[str, int], List[MemeTemplate]] = {}
 
 
 class TemplateRepository:
     _templates: List[MemeTemplate]
+    _unique: List[MemeTemplate]
+    _by_id: Dict[str, MemeTemplate]
 
     def __init__(self, templates_path: Optional[Path] = None) -> None:
         self._templates = []
         self._templates = self._load_templates(templates_path)
+        self._unique = self._dedupe_by_id(self._templates)
+        self._by_id = {t.id: t for t in self._unique}
 
     def all(self) -> List[MemeTemplate]:
         return self._templates
 
     def unique_by_id(self) -> List[MemeTemplate]:
+        # Built once at construction; the same list is returned on every call
+        return self._unique
+
+    all_unique = unique_by_id
+
+    def get(self, template_id: str) -> Optional[MemeTemplate]:
+        # First template loaded with this id, like unique_by_id
+        return self._by_id.get(template_id)
+
+    @staticmethod
+    def _dedupe_by_id(templates: List[MemeTemplate]) -> List[MemeTemplate]:
         # Preserve first occurrence for each template id
         seen: Dict[str, MemeTemplate] = {}
-        for template in self._templates:
+        for template in templates:
             if template.id not in seen:
                 seen[template.id] = template
         return list(seen.values())
 
-    def all_unique(self) -> List[MemeTemplate]:
-        seen: Dict[str, MemeTemplate] = {}
-        for template in self._templates:
-            if template.id not in seen:
-                seen[template.id] = template
-        return list(seen.values())
+    @classmethod
+    def clear_cache(cls) -> None:
+        _TEMPLATE_CACHE.clear()
 
     def _load_templates(self, templates_path: Optional[Path]) -> List[MemeTemplate]:
-        import json
-
         base_path = (
             templates_path
             if templates_path is not None
             else Path(__file__).resolve().parents[1] / "meme_templates.json"
         )
-        with base_path.open("r", encoding="utf-8") as f:
-            raw_list: List[Dict[str, Any]] = json.load(f)
+        base_path = base_path.resolve()
+        key = (str(base_path), base_path.stat().st_mtime_ns)
+        cached = _TEMPLATE_CACHE.get(key)
+        if cached is not None:
+            return cached
+
+        raw_list: List[Dict[str, Any]] = orjson.loads(base_path.read_bytes())
 
         parsed: List[MemeTemplate] = []
         for item in raw_list:
             parsed.append(
                 MemeTemplate(
-                    id=item.get("id", ""),
-                    name=item.get("name", ""),
-                    lines=int(item.get("lines", 0)),
-                    overlays=int(item.get("overlays", 0)),
-                    styles=list(item.get("styles", [])),
-                    blank=str(item.get("blank", "")),
-                    example=dict(item.get("example", {})),
+                    # JSON already yields the right types; only fill in missing fields
+                    id=item.get("id") or "",
+                    name=item.get("name") or "",
+                    lines=item.get("lines") or 0,
+                    overlays=item.get("overlays") or 0,
+                    styles=item.get("styles") or [],
+                    blank=item.get("blank") or "",
+                    example=item.get("example") or {},
                     source=item.get("source"),
-                    keywords=list(item.get("keywords", [])),
-                    self_url=str(item.get("_self", "")),
+                    keywords=item.get("keywords") or [],
+                    self_url=item.get("_self") or "",
                 )
             )
+        _TEMPLATE_CACHE[key] = parsed
         return parsed
 
 
 class TemplateMatch:
+    __slots__ = ("template", "score")
+
     template: MemeTemplate
     score: float
 
@@ -91,50 +160,306 @@ class TemplateMatch:
 
 
 class TemplateMatcher:
-    def rank(self, situation: str, candidates: Iterable[MemeTemplate]) -> List[TemplateMatch]:
+    async def rank(
+        self, situation: str, candidates: Iterable[MemeTemplate], top_k: Optional[int] = None
+    ) -> List[TemplateMatch]:
+        # Best first; when top_k is given only that many matches are returned
         raise NotImplementedError
 
+    async def rank_batch(
+        self, situations: List[str], candidates: Iterable[MemeTemplate], top_k: Optional[int] = None
+    ) -> List[List[TemplateMatch]]:
+        # One ranking per situation, in order; matchers override this when batching is cheaper
+        templates = candidates if isinstance(candidates, list) else list(candidates)
+        return list(await asyncio.gather(*(self.rank(s, templates, top_k) for s in situations)))
+
+    @staticmethod
+    def _top(matches: List[TemplateMatch], top_k: Optional[int]) -> List[TemplateMatch]:
+        if top_k is None:
+            matches.sort(key=lambda m: m.score, reverse=True)
+            return matches
+        # Same order as a stable descending sort, in O(N log k)
+        return heapq.nlargest(max(0, top_k), matches, key=lambda m: m.score)
+
+    @staticmethod
+    def _top_scored(scored: List[Tuple[MemeTemplate, float]], top_k: Optional[int]) -> List[TemplateMatch]:
+        # Select on plain (template, score) pairs; TemplateMatch is only built for the winners
+        if top_k is None:
+            scored.sort(key=lambda pair: pair[1], reverse=True)
+            winners = scored
+        else:
+            winners = heapq.nlargest(max(0, top_k), scored, key=lambda pair: pair[1])
+        return [TemplateMatch(template=t, score=score) for t, score in winners]
+
 
 class SimpleTemplateMatcher(TemplateMatcher):
     _keywords_weight: float
     _name_weight: float
-
-    def __init__(self, keywords_weight: float = 1.0, name_weight: float = 0.5) -> None:
+    _include_zeros: bool
+    _indexed: Optional[List[MemeTemplate]]
+    _kw_vocab: List[str]
+    _kw_matrix: Optional[np.ndarray]
+    _name_vocab: List[str]
+    _name_matrix: Optional[np.ndarray]
+
+    def __init__(self, keywords_weight: float = 1.0, name_weight: float = 0.5, include_zeros: bool = False) -> None:
+        # Zero-scoring templates are left out of rankings unless include_zeros is set
         self._keywords_weight = keywords_weight
         self._name_weight = name_weight
-
-    def rank(self, situation: str, candidates: Iterable[MemeTemplate]) -> List[TemplateMatch]:
+        self._include_zeros = include_zeros
+        self._indexed = None
+        self._kw_vocab = []
+        self._kw_matrix = None
+        self._name_vocab = []
+        self._name_matrix = None
+
+    async def rank(
+        self, situation: str, candidates: Iterable[MemeTemplate], top_k: Optional[int] = None
+    ) -> List[TemplateMatch]:
         situation_lc = situation.lower().strip()
-        results: List[TemplateMatch] = []
+        if not situation_lc:
+            return self._empty_ranking(candidates, top_k)
+        scored: List[Tuple[MemeTemplate, float]] = []
         for t in candidates:
             score = 0.0
-            if situation_lc:
-                for kw in t.keywords:
-                    if kw and kw.lower() in situation_lc:
-                        score += self._keywords_weight
-                if t.name and any(part in situation_lc for part in t.name.lower().split()):
+            for kw in t.keywords_lc:
+                if kw in situation_lc:
+                    score += self._keywords_weight
+            # Plain loop rather than any(genexpr): no generator frame per template
+            for part in t.name_tokens_lc:
+                if part in situation_lc:
                     score += self._name_weight
-            results.append(TemplateMatch(template=t, score=score))
+                    break
+            if score > 0.0 or self._include_zeros:
+                scored.append((t, score))
+
+        return self._top_scored(scored, top_k)
+
+    def _empty_ranking(self, candidates: Iterable[MemeTemplate], top_k: Optional[int]) -> List[TemplateMatch]:
+        # Nothing can match an empty situation; all-zero scores keep candidate order
+        if not self._include_zeros:
+            return []
+        return [TemplateMatch(template=t, score=0.0) for t in itertools.islice(candidates, top_k)]
+
+    async def rank_batch(
+        self, situations: List[str], candidates: Iterable[MemeTemplate], top_k: Optional[int] = None
+    ) -> List[List[TemplateMatch]]:
+        """
+        Rank many situations in one vectorized pass; same scores and order as calling rank for each.
+        Useful for offline evaluation runs. top_k limits each result list.
+        """
+        templates = candidates if isinstance(candidates, list) else list(candidates)
+        if templates is not self._indexed:
+            self._build_matrices(templates)
+        situations_lc = [s.lower().strip() for s in situations]
+
+        # (batch, vocab) presence of each keyword / name token in each situation
+        kw_presence = np.array(
+            [[bool(s) and kw in s for kw in self._kw_vocab] for s in situations_lc], dtype=np.float32
+        ).reshape(len(situations_lc), len(self._kw_vocab))
+        name_presence = np.array(
+            [[bool(s) and part in s for part in self._name_vocab] for s in situations_lc], dtype=np.float32
+        ).reshape(len(situations_lc), len(self._name_vocab))
+
+        scores = self._keywords_weight * (kw_presence @ self._kw_matrix.T)
+        scores += self._name_weight * ((name_presence @ self._name_matrix.T) > 0)
+
+        limit = len(templates) if top_k is None else max(0, top_k)
+        ranked: List[List[TemplateMatch]] = []
+        for row in scores:
+            order = self._top_indices(row, limit)
+            if not self._include_zeros:
+                order = order[row[order] > 0.0]
+            ranked.append([TemplateMatch(template=templates[i], score=float(row[i])) for i in order])
+        return ranked
+
+    @staticmethod
+    def _top_indices(row: np.ndarray, limit: int) -> np.ndarray:
+        n = row.shape[0]
+        if limit <= 0:
+            return np.empty(0, dtype=np.intp)
+        if limit >= n:
+            return np.argsort(-row, kind="stable")
+        # O(N) selection of the k-th best score, then a stable sort of only the entries that reach it
+        kth = np.partition(row, n - limit)[n - limit]
+        shortlist = np.flatnonzero(row >= kth)
+        return shortlist[np.argsort(-row[shortlist], kind="stable")][:limit]
+
+    def _build_matrices(self, templates: List[MemeTemplate]) -> None:
+        kw_index: Dict[str, int] = {}
+        name_index: Dict[str, int] = {}
+        for t in templates:
+            for kw in t.keywords_lc:
+                kw_index.setdefault(kw, len(kw_index))
+            for part in t.name_tokens_lc:
+                name_index.setdefault(part, len(name_index))
+
+        # Keyword entries count repeats (rank adds the weight per listed keyword); name entries are 0/1
+        kw_matrix = np.zeros((len(templates), len(kw_index)), dtype=np.float32)
+        name_matrix = np.zeros((len(templates), len(name_index)), dtype=np.float32)
+        for row, t in enumerate(templates):
+            for kw in t.keywords_lc:
+                kw_matrix[row, kw_index[kw]] += 1.0
+            for part in t.name_tokens_lc:
+                name_matrix[row, name_index[part]] = 1.0
+
+        self._kw_vocab = list(kw_index)
+        self._kw_matrix = kw_matrix
+        self._name_vocab = list(name_index)
+        self._name_matrix = name_matrix
+        self._indexed = templates
+
+
+class AhoCorasickMatcher(TemplateMatcher):
+    """
+    Same scoring as SimpleTemplateMatcher, but all keywords and name tokens are compiled into one
+    Aho-Corasick automaton so a query is a single scan of the situation. The automaton is rebuilt
+    only when a different candidate list is passed. Requires the optional pyahocorasick package;
+    without it ranking is delegated to SimpleTemplateMatcher.
+    """
 
-        results.sort(key=lambda m: m.score, reverse=True)
-        return results
+    _keywords_weight: float
+    _name_weight: float
+    _include_zeros: bool
+    _fallback: SimpleTemplateMatcher
+    _indexed: Optional[List[MemeTemplate]]
+    _automaton: Any
+    _patterns: Dict[str, Tuple[List[int], List[int]]]
+
+    def __init__(self, keywords_weight: float = 1.0, name_weight: float = 0.5, include_zeros: bool = False) -> None:
+        self._keywords_weight = keywords_weight
+        self._name_weight = name_weight
+        self._include_zeros = include_zeros
+        self._fallback = SimpleTemplateMatcher(
+            keywords_weight=keywords_weight, name_weight=name_weight, include_zeros=include_zeros
+        )
+        self._indexed = None
+        self._automaton = None
+        self._patterns = {}
+
+    async def rank(
+        self, situation: str, candidates: Iterable[MemeTemplate], top_k: Optional[int] = None
+    ) -> List[TemplateMatch]:
+        situation_lc = situation.lower().strip()
+        if ahocorasick is None or not situation_lc:
+            return await self._fallback.rank(situation=situation, candidates=candidates, top_k=top_k)
+
+        templates = candidates if isinstance(candidates, list) else list(candidates)
+        if templates is not self._indexed:
+            self._build_automaton(templates)
+
+        scores = [0.0] * len(templates)
+        if self._automaton is not None:
+            # Each pattern scores once however often it occurs, matching the substring semantics
+            found = {pattern for _, pattern in self._automaton.iter(situation_lc)}
+            name_hits = set()
+            for pattern in found:
+                kw_hits, name_idx = self._patterns[pattern]
+                for idx in kw_hits:
+                    scores[idx] += self._keywords_weight
+                name_hits.update(name_idx)
+            for idx in name_hits:
+                scores[idx] += self._name_weight
+
+        scored = [(t, score) for t, score in zip(templates, scores) if score > 0.0 or self._include_zeros]
+        return self._top_scored(scored, top_k)
+
+    def _build_automaton(self, templates: List[MemeTemplate]) -> None:
+        # pattern -> (template indexes per keyword occurrence, template indexes with that name token)
+        patterns: Dict[str, Tuple[List[int], List[int]]] = {}
+        for idx, t in enumerate(templates):
+            for kw in t.keywords_lc:
+                patterns.setdefault(kw, ([], []))[0].append(idx)
+            for part in set(t.name_tokens_lc):
+                patterns.setdefault(part, ([], []))[1].append(idx)
+
+        automaton = None
+        if patterns:
+            automaton = ahocorasick.Automaton()
+            for pattern in patterns:
+                automaton.add_word(pattern, pattern)
+            automaton.make_automaton()
+        self._patterns = patterns
+        self._automaton = automaton
+        self._indexed = templates
+
+
+# Phrases that name a template outright, mapped to its id; see TemplatePicker's bookmarks
+TEMPLATE_BOOKMARKS: Dict[str, str] = {
+    "stonks": "stonks",
+    "distracted boyfriend": "db",
+    "drakeposting": "drake",
+    "change my mind": "cmm",
+}
 
 
 class TemplatePicker:
     _repo: TemplateRepository
     _matcher: TemplateMatcher
+    _cache_size: int
+    _cache: "OrderedDict[Tuple[str, int, bool], Tuple[TemplateMatch, ...]]"
+    _bookmarks: Dict[str, str]
+    _bookmark_pattern: Optional[re.Pattern[str]]
 
-    def __init__(self, repo: TemplateRepository, matcher: Optional[TemplateMatcher] = None) -> None:
+    def __init__(
+        self,
+        repo: TemplateRepository,
+        matcher: Optional[TemplateMatcher] = None,
+        cache_size: int = 256,
+        bookmarks: Optional[Dict[str, str]] = None,
+    ) -> None:
         self._repo = repo
-        self._matcher = matcher or SimpleTemplateMatcher()
+        self._matcher = matcher or AhoCorasickMatcher()
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        # Lower-cased phrase -> template id; a situation naming exactly one of them skips the matcher
+        self._bookmarks = {phrase.lower(): template_id for phrase, template_id in (bookmarks or {}).items() if phrase}
+        self._bookmark_pattern = (
+            re.compile(r"\b(?:" + "|".join(map(re.escape, sorted(self._bookmarks, key=len, reverse=True))) + r")\b")
+            if self._bookmarks
+            else None
+        )
 
-    def pick_top_k(self, situation: str, k: int = 3, unique_ids: bool = True) -> List[TemplateMatch]:
-        candidates = self._repo.unique_by_id() if unique_ids else self._repo.all()
-        ranked = self._matcher.rank(situation=situation, candidates=candidates)
-        return ranked[: max(0, k)]
+    async def pick_top_k(self, situation: str, k: int = 3, unique_ids: bool = True) -> List[TemplateMatch]:
+        bookmarked = self._bookmarked(situation)
+        if bookmarked is not None:
+            # A bookmark hit returns only that template, whatever k is; filling the other k-1 slots
+            # would need the matcher call the fast path exists to skip
+            return [TemplateMatch(template=bookmarked, score=1.0)][: max(0, k)]
+
+        # Keyword matchers are deterministic, so repeated situations are answered from an LRU;
+        # LLM-backed matchers are sampled and always asked again
+        cacheable = self._cache_size > 0 and isinstance(self._matcher, (SimpleTemplateMatcher, AhoCorasickMatcher))
+        key = (situation.lower().strip(), max(0, k), unique_ids)
+        if cacheable:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return list(cached)
 
-    def pick_best(self, situation: str, unique_ids: bool = True) -> Optional[TemplateMatch]:
-        top = self.pick_top_k(situation=situation, k=1, unique_ids=unique_ids)
+        candidates = self._repo.unique_by_id() if unique_ids else self._repo.all()
+        ranked = await self._matcher.rank(situation=situation, candidates=candidates, top_k=max(0, k))
+        ranked = ranked[: max(0, k)]
+        if cacheable:
+            self._cache[key] = tuple(ranked)
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return ranked
+
+    def clear_cache(self) -> None:
+        self._cache.clear()
+
+    def _bookmarked(self, situation: str) -> Optional[MemeTemplate]:
+        if self._bookmark_pattern is None:
+            return None
+        ids = {self._bookmarks[m] for m in self._bookmark_pattern.findall(situation.lower())}
+        # Only unambiguous mentions are trusted; anything else goes through the matcher
+        if len(ids) != 1:
+            return None
+        return self._repo.get(ids.pop())
+
+    async def pick_best(self, situation: str, unique_ids: bool = True) -> Optional[TemplateMatch]:
+        top = await self.pick_top_k(situation=situation, k=1, unique_ids=unique_ids)
         return top[0] if top else None
 
 
@@ -142,32 +467,89 @@ class OpenRouterTemplateMatcher(TemplateMatcher):
     _model: str
     _client: Any
     _max_candidates: int
+    _rng: random.Random
+    _indexed: Optional[List[MemeTemplate]]
+    _candidate_list: List[MemeTemplate]
+    _id_to_template: Dict[str, MemeTemplate]
 
     def __init__(
         self,
         model: str = "google/gemini-2.5-flash-image-preview:free",
         client: Optional[Any] = None,
         max_candidates: int = 207,
+        rng: Optional[random.Random] = None,
     ) -> None:
-        from .clients import OpenRouterClient, GoogleClient
-
         self._model = model
-        if client is not None:
-            self._client = client
-        else:
-            provider_raw = os.getenv("MEMEGEN_PROVIDER", "").strip().strip("\"'").lower()
-            use_openrouter = provider_raw.startswith("openrouter")
-            self._client = OpenRouterClient() if use_openrouter else GoogleClient()
+        self._client = client if client is not None else _default_client()
         self._max_candidates = max_candidates
+        # Own generator instead of the shared module-level one; inject a seeded one for stable prompts
+        self._rng = rng or random.Random()
+        self._indexed = None
+        self._candidate_list = []
+        self._id_to_template = {}
+
+    async def rank(
+        self, situation: str, candidates: Iterable[MemeTemplate], top_k: Optional[int] = None
+    ) -> List[TemplateMatch]:
+        candidate_list, id_to_template = self._index_candidates(candidates)
+        prompt = self._build_prompt(situation=situation, candidates=candidate_list)
+        content = await self._client.chat(
+            messages=self._messages(prompt), model=self._model, temperature=0.8, max_tokens=512
+        )
+        rankings = self._parse_rankings_text(content)
+        return self._to_matches(rankings, id_to_template, top_k)
 
-    def rank(self, situation: str, candidates: Iterable[MemeTemplate]) -> List[TemplateMatch]:
-        candidate_list: List[MemeTemplate] = list(candidates)
-        if self._max_candidates > 0:
-            candidate_list = candidate_list[: self._max_candidates]
+    async def rank_batch(
+        self, situations: List[str], candidates: Iterable[MemeTemplate], top_k: Optional[int] = None
+    ) -> List[List[TemplateMatch]]:
+        """
+        Rank several situations with a single LLM call that lists them all against one template list.
+        Situations the model leaves out of its reply are ranked individually.
+        """
+        if len(situations) <= 1:
+            return [await self.rank(s, candidates, top_k) for s in situations]
 
-        prompt = self._build_prompt(situation=situation, candidates=candidate_list)
+        candidate_list, id_to_template = self._index_candidates(candidates)
+        prompt = self._build_batch_prompt(situations=situations, candidates=candidate_list)
+        content = await self._client.chat(
+            messages=self._messages(prompt),
+            model=self._model,
+            temperature=0.8,
+            max_tokens=min(4096, 512 * len(situations)),
+        )
 
-        messages = [
+        results: List[Optional[List[TemplateMatch]]] = [None] * len(situations)
+        for entry in self._parse_json_array(content) or []:
+            if not isinstance(entry, dict):
+                continue
+            idx = entry.get("i")
+            rankings = entry.get("rankings")
+            if isinstance(idx, int) and 0 <= idx < len(situations) and isinstance(rankings, list):
+                rankings = [x for x in rankings if isinstance(x, dict) and "id" in x]
+                results[idx] = self._to_matches(rankings, id_to_template, top_k)
+
+        missing = [idx for idx, r in enumerate(results) if r is None]
+        if missing:
+            retried = await asyncio.gather(*(self.rank(situations[idx], candidates, top_k) for idx in missing))
+            for idx, matches in zip(missing, retried):
+                results[idx] = matches
+        return [r or [] for r in results]
+
+    def _index_candidates(
+        self, candidates: Iterable[MemeTemplate]
+    ) -> Tuple[List[MemeTemplate], Dict[str, MemeTemplate]]:
+        # The picker passes the same list every time; rebuild the truncated list and id map only on change
+        if candidates is not self._indexed:
+            candidate_list: List[MemeTemplate] = list(candidates)
+            if self._max_candidates > 0:
+                candidate_list = candidate_list[: self._max_candidates]
+            self._candidate_list = candidate_list
+            self._id_to_template = {t.id: t for t in candidate_list}
+            self._indexed = candidates if isinstance(candidates, list) else None
+        return self._candidate_list, self._id_to_template
+
+    def _messages(self, prompt: str) -> List[Dict[str, Any]]:
+        return [
             {
                 "role": "system",
                 "content": (
@@ -177,62 +559,446 @@ class OpenRouterTemplateMatcher(TemplateMatcher):
             },
             {"role": "user", "content": prompt},
         ]
-        content = self._client.chat(messages=messages, model=self._model, temperature=0.8, max_tokens=512)
 
-        rankings = self._parse_rankings_text(content)
-
-        id_to_template: Dict[str, MemeTemplate] = {t.id: t for t in candidate_list}
+    def _to_matches(
+        self, rankings: List[Dict[str, Any]], id_to_template: Dict[str, MemeTemplate], top_k: Optional[int]
+    ) -> List[TemplateMatch]:
         matches: List[TemplateMatch] = []
         for item in rankings:
             template = id_to_template.get(item["id"])  # type: ignore[index]
             score = float(item.get("score", 0.0))  # type: ignore[assignment]
             if template is not None:
                 matches.append(TemplateMatch(template=template, score=score))
+        return self._top(matches, top_k)
 
-        matches.sort(key=lambda m: m.score, reverse=True)
-        return matches
+    def _templates_json(self, candidates: List[MemeTemplate]) -> str:
+        # Templates carry their serialized form; only the order changes per call, shuffled to avoid
+        # position bias in the model's picks
+        fragments = [t.prompt_json for t in candidates]
+        self._rng.shuffle(fragments)
+        return "[" + ",".join(fragments) + "]"
 
     def _build_prompt(self, situation: str, candidates: List[MemeTemplate]) -> str:
-        candidates = candidates.copy()
-        random.shuffle(candidates)
-        compact = [
-            {
-                "id": t.id,
-                "name": t.name,
-            }
-            for t in candidates
-        ]
-
         return (
             "Given a situation description and a list of meme templates, rank the most suitable templates.\n\n"
             f"Situation: {situation}\n\n"
-            f"Templates: {json.dumps(compact, ensure_ascii=False)}\n\n"
+            f"Templates: {self._templates_json(candidates)}\n\n"
             'Return ONLY JSON in this exact shape: [{"id": "<template_id>", "score": <0..1>}].\n'
             "Include up to 5 items."
         )
 
-    def _parse_rankings_text(self, text: str) -> List[Dict[str, Any]]:
+    def _build_batch_prompt(self, situations: List[str], candidates: List[MemeTemplate]) -> str:
+        numbered = [{"i": idx, "situation": situation} for idx, situation in enumerate(situations)]
+        return (
+            "Given several situation descriptions and a list of meme templates, rank the most suitable "
+            "templates for each situation independently.\n\n"
+            f"Situations: {orjson.dumps(numbered).decode('utf-8')}\n\n"
+            f"Templates: {self._templates_json(candidates)}\n\n"
+            'Return ONLY JSON in this exact shape: [{"i": <situation index>, "rankings": '
+            '[{"id": "<template_id>", "score": <0..1>}]}].\n'
+            "Include one entry per situation with up to 5 rankings each."
+        )
+
+    def _parse_rankings_text(self, text: Union[str, bytes]) -> List[Dict[str, Any]]:
+        parsed = self._parse_json_array(text)
+        if parsed is None:
+            return []
+        return [x for x in parsed if isinstance(x, dict) and "id" in x]
 
-        data: List[Dict[str, Any]] = []
+    def _parse_json_array(self, text: Union[str, bytes]) -> Optional[List[Any]]:
         if not text:
-            return data
-        try:
-            parsed = json.loads(text)
+            return None
+        if isinstance(text, bytes):
+            # orjson reads bytes directly; only the prose fallback needs a str
+            try:
+                parsed = orjson.loads(text)
+            except orjson.JSONDecodeError:
+                parsed = None
             if isinstance(parsed, list):
-                return [x for x in parsed if isinstance(x, dict) and "id" in x]
-        except Exception:
-            pass
+                return parsed
+            text = text.decode("utf-8", errors="replace")
         start = text.find("[")
-        end = text.rfind("]")
-        if start != -1 and end != -1 and end > start:
-            snippet = text[start : end + 1]
+        if start == -1:
+            return None
+        parsed = None
+        if not text[:start].strip():
+            # Bare JSON (the usual reply): one orjson pass
             try:
-                parsed = json.loads(snippet)
-                if isinstance(parsed, list):
-                    return [x for x in parsed if isinstance(x, dict) and "id" in x]
-            except Exception:
+                parsed = orjson.loads(text)
+            except orjson.JSONDecodeError:
+                parsed = None
+        if isinstance(parsed, list):
+            return parsed
+        # Prose or code fences around the array: decode in place from each "[" (ignoring whatever
+        # follows the array) until one yields a list of objects, e.g. past a bracketed "[note]"
+        while start != -1:
+            try:
+                parsed, _ = _JSON_DECODER.raw_decode(text, start)
+            except json.JSONDecodeError:
+                parsed = None
+            if isinstance(parsed, list) and any(isinstance(x, dict) for x in parsed):
+                return parsed
+            start = text.find("[", start + 1)
+        return None
+
+
+class CoalescingTemplateMatcher(TemplateMatcher):
+    """
+    Groups rank calls that arrive close together into one rank_batch call on the wrapped matcher.
+
+    A batch is flushed when it reaches max_batch situations or window seconds after its first call,
+    trading a little latency for fewer upstream requests under concurrent load. Calls with different
+    candidate lists are batched separately.
+    """
+
+    _matcher: TemplateMatcher
+    _max_batch: int
+    _window: float
+    _pending: Dict[int, Tuple[Iterable[MemeTemplate], List[Tuple[str, "asyncio.Future[List[TemplateMatch]]"]], Any]]
+    _tasks: set
+
+    def __init__(self, matcher: TemplateMatcher, max_batch: int = 8, window: float = 0.02) -> None:
+        self._matcher = matcher
+        self._max_batch = max(1, max_batch)
+        self._window = window
+        self._pending = {}
+        self._tasks = set()
+
+    async def rank(
+        self, situation: str, candidates: Iterable[MemeTemplate], top_k: Optional[int] = None
+    ) -> List[TemplateMatch]:
+        loop = asyncio.get_running_loop()
+        future: "asyncio.Future[List[TemplateMatch]]" = loop.create_future()
+        key = id(candidates)
+        batch = self._pending.get(key)
+        if batch is None:
+            timer = loop.call_later(self._window, self._flush, key)
+            batch = (candidates, [], timer)
+            self._pending[key] = batch
+        batch[1].append((situation, future))
+        if len(batch[1]) >= self._max_batch:
+            self._flush(key)
+        matches = await future
+        return matches[:top_k]
+
+    def _flush(self, key: int) -> None:
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        candidates, items, timer = batch
+        timer.cancel()
+        task = asyncio.get_running_loop().create_task(self._run_batch(candidates, items))
+        # Keep a reference until done so the task isn't garbage collected mid-flight
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(
+        self,
+        candidates: Iterable[MemeTemplate],
+        items: List[Tuple[str, "asyncio.Future[List[TemplateMatch]]"]],
+    ) -> None:
+        try:
+            results = await self._matcher.rank_batch([situation for situation, _ in items], candidates)
+            if len(results) != len(items):
+                raise RuntimeError(f"rank_batch returned {len(results)} rankings for {len(items)} situations")
+            for (_, future), matches in zip(items, results):
+                if not future.done():
+                    future.set_result(matches)
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # Never leave a caller waiting, e.g. when this task is cancelled
+            for _, future in items:
+                if not future.done():
+                    future.cancel()
+
+
+class EmbeddingStore:
+    """
+    Persistent embedding cache in a local SQLite file.
+
+    Vectors are stored as float32 bytes keyed by the SHA-256 of (model, text), so repeated texts skip
+    the embedding call across restarts. Methods block; call them from a worker thread.
+    """
+
+    _path: Path
+    _conn: Optional[sqlite3.Connection]
+    _lock: threading.Lock
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self._path = path if path is not None else Path(tempfile.gettempdir()) / "memegen_cache" / "embeddings.sqlite3"
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = (
+                self._connect()
+                .execute("SELECT dim, vector FROM embeddings WHERE key = ?", (self._key(model, text),))
+                .fetchone()
+            )
+        if row is None:
+            return None
+        dim, blob = row
+        vector = np.frombuffer(blob, dtype=np.float32)
+        return vector if vector.shape[0] == dim else None
+
+    def put(self, model: str, text: str, vector: np.ndarray) -> None:
+        vector = np.ascontiguousarray(vector, dtype=np.float32)
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, dim, vector) VALUES (?, ?, ?)",
+                (self._key(model, text), int(vector.shape[0]), vector.tobytes()),
+            )
+            conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            # Used from worker threads; access is serialized by self._lock
+            conn = sqlite3.connect(str(self._path), check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class SemanticTemplateCache(TemplateMatcher):
+    """
+    Caches rankings of a wrapped matcher so repeated or paraphrased situations skip its LLM call.
+
+    Exact repeats (after case/whitespace normalization) are served from a hash lookup. Otherwise the
+    situation is embedded and compared to previously ranked situations; if the best cosine
+    similarity reaches the threshold, that ranking is reused. The candidate set is assumed stable.
+
+    With a path, entries are persisted to an .npz file after each insert and reloaded on first use,
+    so paraphrases hit across process restarts.
+    """
+
+    _matcher: TemplateMatcher
+    _client: Any
+    _model: Optional[str]
+    _threshold: float
+    _max_entries: int
+    _entries: "OrderedDict[str, List[TemplateMatch]]"
+    _embeddings: Dict[str, np.ndarray]
+    _keys: List[str]
+    _matrix: Optional[np.ndarray]
+    _store: Optional[EmbeddingStore]
+    _path: Optional[Path]
+    _loaded: bool
+    _logger: logging.Logger
+
+    def __init__(
+        self,
+        matcher: TemplateMatcher,
+        client: Optional[Any] = None,
+        model: Optional[str] = None,
+        threshold: float = 0.90,
+        max_entries: int = 1024,
+        store: Optional[EmbeddingStore] = None,
+        path: Optional[Path] = None,
+    ) -> None:
+        self._matcher = matcher
+        self._client = client if client is not None else _default_client()
+        self._model = model
+        self._store = store
+        self._path = path
+        self._loaded = path is None
+        self._threshold = threshold
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._embeddings = {}
+        self._keys = []
+        self._matrix = None
+        self._logger = logging.getLogger("ai.memegen")
+
+    async def rank(
+        self, situation: str, candidates: Iterable[MemeTemplate], top_k: Optional[int] = None
+    ) -> List[TemplateMatch]:
+        if not self._loaded:
+            candidates = candidates if isinstance(candidates, list) else list(candidates)
+            await self._load(candidates)
+
+        key = self._key(situation)
+        cached = self._entries.get(key)
+        if cached is not None:
+            self._entries.move_to_end(key)
+            return cached[:top_k]
+
+        embedding = await self._embed(situation)
+        if embedding is not None:
+            nearest = self._nearest(embedding)
+            if nearest is not None:
+                self._entries.move_to_end(nearest)
+                return self._entries[nearest][:top_k]
+
+        matches = await self._matcher.rank(situation=situation, candidates=candidates)
+        if matches:
+            self._insert(key, embedding, matches)
+            await self._save()
+        return matches[:top_k]
+
+    def _key(self, situation: str) -> str:
+        normalized = " ".join(situation.lower().split())
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    async def _embed(self, situation: str) -> Optional[np.ndarray]:
+        model = self._model or str(getattr(self._client, "DEFAULT_EMBEDDING_MODEL", ""))
+        if self._store is not None:
+            try:
+                stored = await asyncio.to_thread(self._store.get, model, situation)
+            except (OSError, sqlite3.Error) as e:
+                self._logger.warning("cid=n/a step=embedding_store_read_error error=%r", e)
+                stored = None
+            if stored is not None:
+                return stored
+
+        try:
+            vectors = await self._client.embed([situation], model=self._model)
+        except Exception as e:
+            self._logger.warning("cid=n/a step=semantic_cache_embed_error error=%r", e)
+            return None
+        if not vectors or not vectors[0]:
+            return None
+        embedding = np.asarray(vectors[0], dtype=np.float32)
+
+        if self._store is not None:
+            try:
+                await asyncio.to_thread(self._store.put, model, situation, embedding)
+            except (OSError, sqlite3.Error) as e:
+                # Best-effort, like the image cache
+                self._logger.warning("cid=n/a step=embedding_store_write_error error=%r", e)
+        return embedding
+
+    def _nearest(self, embedding: np.ndarray) -> Optional[str]:
+        if self._matrix is None:
+            self._rebuild_index()
+        if self._matrix is None or self._matrix.shape[1] != embedding.shape[0]:
+            return None
+        query_norm = float(np.linalg.norm(embedding))
+        if query_norm == 0.0:
+            return None
+        # Rows are unit length, so cosine similarity is a single matrix-vector product
+        sims = self._matrix @ (embedding / query_norm)
+        best = int(np.argmax(sims))
+        if float(sims[best]) >= self._threshold:
+            return self._keys[best]
+        return None
+
+    def _insert(self, key: str, embedding: Optional[np.ndarray], matches: List[TemplateMatch]) -> None:
+        self._entries[key] = list(matches)
+        self._entries.move_to_end(key)
+        if embedding is not None:
+            self._embeddings[key] = embedding
+        while len(self._entries) > self._max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._embeddings.pop(evicted, None)
+        self._matrix = None
+
+    def _rebuild_index(self) -> None:
+        self._keys = [k for k in self._entries if k in self._embeddings]
+        if not self._keys:
+            self._matrix = None
+            return
+        matrix = np.stack([self._embeddings[k] for k in self._keys]).astype(np.float32, copy=False)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        # Degenerate vectors become zero rows and never reach the threshold
+        norms[norms == 0.0] = np.inf
+        self._matrix = np.ascontiguousarray(matrix / norms)
+
+    async def _load(self, candidates: List[MemeTemplate]) -> None:
+        self._loaded = True
+        try:
+            arrays = await asyncio.to_thread(self._read_file)
+        except (OSError, ValueError, KeyError) as e:
+            self._logger.warning("cid=n/a step=semantic_cache_load_error error=%r", e)
+            return
+        if arrays is None:
+            return
+
+        by_id = {t.id: t for t in candidates}
+        keys, embeddings, has_embedding, ids, scores, offsets = arrays
+        embeddings = embeddings.astype(np.float32)
+        for i, key in enumerate(keys):
+            start, end = int(offsets[i]), int(offsets[i + 1])
+            templates = [by_id.get(str(template_id)) for template_id in ids[start:end]]
+            # Rankings that mention templates no longer in the repository are dropped
+            if not templates or any(t is None for t in templates):
+                continue
+            matches = [TemplateMatch(template=t, score=float(score)) for t, score in zip(templates, scores[start:end])]
+            self._insert(str(key), embeddings[i] if has_embedding[i] else None, matches)
+
+    def _read_file(self) -> Optional[Tuple[np.ndarray, ...]]:
+        assert self._path is not None
+        if not self._path.exists():
+            return None
+        with np.load(self._path, allow_pickle=False) as data:
+            return tuple(
+                data[name] for name in ("keys", "embeddings", "has_embedding", "template_ids", "scores", "offsets")
+            )
+
+    async def _save(self) -> None:
+        if self._path is None:
+            return
+        keys = list(self._entries)
+        dim = next((e.shape[0] for e in self._embeddings.values()), 0)
+        # Only cosine similarity is used, so unit-length float16 rows are enough and halve the file
+        embeddings = np.zeros((len(keys), dim), dtype=np.float16)
+        has_embedding = np.zeros(len(keys), dtype=bool)
+        for i, key in enumerate(keys):
+            embedding = self._embeddings.get(key)
+            if embedding is None or embedding.shape[0] != dim:
+                continue
+            norm = float(np.linalg.norm(embedding))
+            if norm > 0.0:
+                embeddings[i] = embedding / norm
+                has_embedding[i] = True
+        rankings = [self._entries[k] for k in keys]
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(r) for r in rankings])
+        arrays = {
+            "keys": np.array(keys, dtype=str),
+            "embeddings": embeddings,
+            "has_embedding": has_embedding,
+            "template_ids": np.array([m.template.id for r in rankings for m in r], dtype=str),
+            "scores": np.array([m.score for r in rankings for m in r], dtype=np.float32),
+            "offsets": offsets,
+        }
+        try:
+            await asyncio.to_thread(self._write_file, arrays)
+        except OSError as e:
+            # Best-effort, like the image cache
+            self._logger.warning("cid=n/a step=semantic_cache_save_error error=%r", e)
+
+    def _write_file(self, arrays: Dict[str, np.ndarray]) -> None:
+        assert self._path is not None
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=str(self._path.parent), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_name, self._path)
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
                 pass
-        return data
+            raise
 
 
 class ImageEditPromptGenerator:
@@ -253,17 +1019,10 @@ class ImageEditPromptGenerator:
         client: Optional[Any] = None,
         model: str = "google/gemini-2.5-flash-image-preview:free",
     ) -> None:
-        from .clients import OpenRouterClient, GoogleClient
-
-        if client is not None:
-            self._client = client
-        else:
-            provider_raw = os.getenv("MEMEGEN_PROVIDER", "").strip().strip("\"'").lower()
-            use_openrouter = provider_raw.startswith("openrouter")
-            self._client = OpenRouterClient() if use_openrouter else GoogleClient()
+        self._client = client if client is not None else _default_client()
         self._model = model
 
-    def create_prompt(
+    async def create_prompt(
         self,
         user_description: str,
         template: MemeTemplate,
@@ -330,24 +1089,14 @@ class ImageEditPromptGenerator:
         # Attach provided template image if available
         if template_image is not None:
             try:
-                user_content.append(
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": template_image.as_data_uri()},
-                    }
-                )
+                user_content.append(template_image.as_content_part())
             except Exception:
                 pass
 
         # Attach provided reference image if available
         if reference_image is not None:
             try:
-                user_content.append(
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": reference_image.as_data_uri()},
-                    }
-                )
+                user_content.append(reference_image.as_content_part())
             except Exception:
                 pass
 
@@ -355,7 +1104,7 @@ class ImageEditPromptGenerator:
 
         messages = [system_msg, {"role": "user", "content": user_content}]  # type: ignore[dict-item]
 
-        content = self._client.chat(messages=messages, model=self._model, temperature=0.8, max_tokens=256)
+        content = await self._client.chat(messages=messages, model=self._model, temperature=0.8, max_tokens=256)
         return content.strip()
 
 
@@ -365,9 +1114,21 @@ class DownloadedImage:
     content: bytes
     mime_type: str
 
+    @functools.cached_property
+    def inline(self) -> InlineImage:
+        # Holds the base64 text, encoded once per DownloadedImage so the prompt and generation calls share it
+        return InlineImage(mime_type=self.mime_type, content=self.content)
+
+    @functools.cached_property
+    def data_uri(self) -> str:
+        return self.inline.data_uri()
+
     def as_data_uri(self) -> str:
-        encoded = base64.b64encode(self.content).decode("utf-8")
-        return f"data:{self.mime_type};base64,{encoded}"
+        return self.data_uri
+
+    def as_content_part(self) -> Dict[str, Any]:
+        # The client serializes the inline image itself, so no data URI string is built for Google requests
+        return {"type": "image_url", "image_url": {"url": self.inline}}
 
 
 class SafetyRefusalError(Exception):
@@ -383,32 +1144,120 @@ class ImageDownloader:
     def __init__(self, timeout: float = 30.0) -> None:
         self._timeout = timeout
 
-    def download(self, url: str) -> DownloadedImage:
-        # Single retry on transient failure
-        last_error: Optional[Exception] = None
-        for attempt in range(2):
-            try:
-                resp = requests.get(url, timeout=self._timeout)
-                resp.raise_for_status()
-                content_type = resp.headers.get("Content-Type", "").split(";")[0].strip()
-                mime = content_type or self._guess_mime_from_url(url) or "image/png"
-                return DownloadedImage(url=url, content=resp.content, mime_type=mime)
-            except Exception as e:
-                last_error = e
-                if attempt == 1:
-                    raise
-                continue
-        # Satisfy type checker; in practice we either returned or raised
-        raise RuntimeError(f"Failed to download image from {url}: {last_error}")
+    async def download(self, url: str) -> DownloadedImage:
+        # Pooled keep-alive connection; transient failures are retried by fetch_bytes
+        content, content_type = await fetch_bytes(url, self._timeout)
+        mime = content_type or self._guess_mime_from_url(url) or "image/png"
+        return DownloadedImage(url=url, content=content, mime_type=mime)
 
     def _guess_mime_from_url(self, url: str) -> str:
-        guess, _ = mimetypes.guess_type(url)
-        return guess or ""
+        # Only the path's extension matters (a query string would otherwise hide it)
+        return _mime_for_ext(os.path.splitext(urlsplit(url).path)[1].lower())
+
+
+class CachedImageDownloader(ImageDownloader):
+    """
+    ImageDownloader that keeps a bounded on-disk copy of every image it fetches.
+
+    Entries are keyed by the SHA-256 of the URL and evicted least-recently-used once the cache
+    directory grows past max_bytes. Meant for static assets such as template blanks.
+    """
+
+    _cache_dir: Path
+    _max_bytes: int
+
+    def __init__(
+        self,
+        timeout: float = 30.0,
+        cache_dir: Optional[Path] = None,
+        max_bytes: int = 200 * 1024 * 1024,
+    ) -> None:
+        super().__init__(timeout=timeout)
+        self._cache_dir = cache_dir if cache_dir is not None else Path(tempfile.gettempdir()) / "memegen_cache"
+        self._max_bytes = max_bytes
+
+    async def download(self, url: str) -> DownloadedImage:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        data_path = self._cache_dir / f"{key}.bin"
+        meta_path = self._cache_dir / f"{key}.meta"
+
+        cached = await asyncio.to_thread(self._read_cached, url, data_path, meta_path)
+        if cached is not None:
+            return cached
+
+        image = await super().download(url)
+        try:
+            await asyncio.to_thread(self._write_cached, image, data_path, meta_path)
+        except OSError:
+            # Cache is best-effort; the downloaded image is still valid
+            pass
+        return image
+
+    def _read_cached(self, url: str, data_path: Path, meta_path: Path) -> Optional[DownloadedImage]:
+        try:
+            meta = orjson.loads(meta_path.read_bytes())
+            content = data_path.read_bytes()
+            # Bump mtime so eviction drops least recently used entries first
+            os.utime(data_path)
+        except (OSError, ValueError):
+            return None
+        return DownloadedImage(url=url, content=content, mime_type=str(meta.get("mime_type") or "image/png"))
+
+    def _write_cached(self, image: DownloadedImage, data_path: Path, meta_path: Path) -> None:
+        self._cache_dir.mkdir(parents=True, exist_ok=True)
+        # Write data before meta so a readable meta file always has its payload next to it
+        self._write_atomic(data_path, image.content)
+        self._write_atomic(meta_path, orjson.dumps({"url": image.url, "mime_type": image.mime_type}))
+        self._prune()
+
+    def _write_atomic(self, path: Path, payload: bytes) -> None:
+        fd, tmp_name = tempfile.mkstemp(dir=str(self._cache_dir), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_name, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+            raise
+
+    def _prune(self) -> None:
+        entries: List[Tuple[float, int, Path]] = []
+        total = 0
+        for data_path in self._cache_dir.glob("*.bin"):
+            try:
+                st = data_path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, data_path))
+            total += st.st_size
+        if total <= self._max_bytes:
+            return
+        entries.sort()
+        for _, size, data_path in entries:
+            if total <= self._max_bytes:
+                break
+            for path in (data_path.with_suffix(".meta"), data_path):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            total -= size
+
+
+@functools.lru_cache(maxsize=32)
+def _mime_for_ext(ext: str) -> str:
+    # Images come with a handful of extensions; skip guess_type's full parsing after the first lookup
+    if not ext:
+        return ""
+    guess, _ = mimetypes.guess_type("file" + ext)
+    return guess or ""
 
 
 def _guess_mime_from_path(path: str) -> str:
-    guess, _ = mimetypes.guess_type(path)
-    return guess or "image/png"
+    return _mime_for_ext(os.path.splitext(path)[1].lower()) or "image/png"
 
 
 @dataclass(frozen=True)
@@ -440,18 +1289,17 @@ class MemeImageGenerator:
     _logger: logging.Logger
 
     def __init__(self, client: Optional[Any] = None, model: str = "google/gemini-2.5-flash-image-preview:free") -> None:
-        from .clients import OpenRouterClient, GoogleClient
-
-        if client is not None:
-            self._client = client
-        else:
-            provider_raw = os.getenv("MEMEGEN_PROVIDER", "").strip().strip("\"'").lower()
-            use_openrouter = provider_raw.startswith("openrouter")
-            self._client = OpenRouterClient() if use_openrouter else GoogleClient()
+        self._client = client if client is not None else _default_client()
         self._model = model
         self._logger = logging.getLogger("ai.memegen")
 
-    def generate(
+    async def warm_up(self) -> None:
+        # Lets callers establish the connection to the image model while earlier steps run
+        warm_up = getattr(self._client, "warm_up", None)
+        if warm_up is not None:
+            await warm_up()
+
+    async def generate(
         self,
         prompt: str,
         template_image: DownloadedImage,
@@ -465,21 +1313,11 @@ class MemeImageGenerator:
         user_content.append({"type": "text", "text": prompt})
 
         # Template image must be attached
-        user_content.append(
-            {
-                "type": "image_url",
-                "image_url": {"url": template_image.as_data_uri()},
-            }
-        )
+        user_content.append(template_image.as_content_part())
 
         # Optional reference image
         if reference_image is not None:
-            user_content.append(
-                {
-                    "type": "image_url",
-                    "image_url": {"url": reference_image.as_data_uri()},
-                }
-            )
+            user_content.append(reference_image.as_content_part())
 
         messages = [
             {
@@ -494,13 +1332,13 @@ class MemeImageGenerator:
         ]
 
         # Ask for raw JSON so we can extract image content
-        data = self._client.chat_raw(
+        data = await self._client.chat_raw(
             messages=messages,
             model=self._model,
             temperature=temperature,
             max_tokens=max_tokens,
         )
-        return self._extract_generated_image(data)
+        return await self._extract_generated_image(data)
 
     def _parse_data_uri(self, data_uri: str) -> Tuple[str, bytes]:
         # data:[<mime>];base64,<payload>
@@ -559,24 +1397,25 @@ class MemeImageGenerator:
                                             b64 = image_url.get("b64_json")
                                             redacted["b64_len"] = len(b64) if isinstance(b64, str) else None
                                         summary["images_0_image_url"] = redacted
-            text = json.dumps(summary, ensure_ascii=False)
+            text = orjson.dumps(summary).decode("utf-8")
             if len(text) > 4000:
                 text = text[:4000] + "...(truncated)"
             return text
         except Exception:
             try:
-                text = json.dumps(data, ensure_ascii=False)
+                text = orjson.dumps(data).decode("utf-8")
                 if len(text) > 4000:
                     text = text[:4000] + "...(truncated)"
                 return text
             except Exception:
                 return str(type(data))
 
-    def _extract_generated_image(self, data: Dict[str, Any]) -> "GeneratedImage":
+    async def _extract_generated_image(self, data: Dict[str, Any]) -> "GeneratedImage":
         """Protected parser for the OpenRouter JSON response.
 
         Expects shape with an image in choices[0].message.images[0].image_url.
-        Supports data URIs, http(s) URLs, and b64_json.
+        Supports data URIs, http(s) URLs, and b64_json, plus already decoded image_bytes
+        as produced by the Google client.
         """
         try:
             choice = data["choices"][0]
@@ -606,6 +1445,11 @@ class MemeImageGenerator:
             if not isinstance(first_image, dict):
                 raise RuntimeError("Invalid image entry in response")
 
+            image_bytes = first_image.get("image_bytes")
+            if isinstance(image_bytes, bytes) and image_bytes:
+                mime_type = str(first_image.get("mime_type") or "image/png")
+                return GeneratedImage(mime_type=mime_type, content=image_bytes)
+
             image_spec = first_image.get("image_url")
             url: str = ""
             if isinstance(image_spec, dict):
@@ -622,7 +1466,7 @@ class MemeImageGenerator:
                 return GeneratedImage(mime_type=mime, content=b)
 
             if isinstance(url, str) and (url.startswith("http://") or url.startswith("https://")):
-                downloaded = ImageDownloader().download(url)
+                downloaded = await ImageDownloader().download(url)
                 return GeneratedImage(mime_type=downloaded.mime_type, content=downloaded.content)
 
             raise RuntimeError("Image URL missing or unsupported format in response")
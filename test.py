@@ -1,63 +1,184 @@
+import asyncio
+import functools
+import mimetypes
+import os
+import tempfile
+from pathlib import Path
 from typing import Optional
 
+from src.clients import close_session
 from src.core import (
+    CachedImageDownloader,
     DownloadedImage,
-    ImageDownloader,
+    EmbeddingStore,
     ImageEditPromptGenerator,
     MemeImageGenerator,
     OpenRouterTemplateMatcher,
+    SemanticTemplateCache,
+    TEMPLATE_BOOKMARKS,
     TemplatePicker,
     TemplateRepository,
 )
 
 
-def test_run(description: str, reference_image: Optional[str] = None):
-    ref_img = None
+async def test_run(description: str, reference_image: Optional[str] = None):
+    try:
+        return await _run(description, reference_image)
+    finally:
+        await close_session()
 
-    if reference_image:
-        with open(reference_image, "rb") as f:
-            ref_img = DownloadedImage(url=reference_image, content=f.read(), mime_type="image/png")
 
-    picker = TemplatePicker(
+@functools.lru_cache(maxsize=1)
+def _picker() -> TemplatePicker:
+    # Shared across test_run calls so repeated prompts reuse the repository and the ranking caches
+    return TemplatePicker(
         repo=TemplateRepository(),
-        matcher=OpenRouterTemplateMatcher(),
+        # Paraphrased descriptions reuse rankings from earlier runs
+        matcher=SemanticTemplateCache(
+            matcher=OpenRouterTemplateMatcher(),
+            path=Path(tempfile.gettempdir()) / "memegen_cache" / "semcache.npz",
+            store=EmbeddingStore(),
+        ),
+        bookmarks=TEMPLATE_BOOKMARKS,
     )
 
-    templates = picker.pick_top_k(situation=description)
 
-    print("\nPicked templates:")
-    for t in templates:
-        print(t.score, t.template)
+def _slurp(path: str) -> bytes:
+    if not hasattr(os, "posix_fadvise"):
+        with open(path, "rb") as f:
+            return f.read()
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        size = os.fstat(fd).st_size
+        chunks = []
+        while size > 0:
+            chunk = os.read(fd, size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size -= len(chunk)
+        # Read once, so drop it from the page cache
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return chunks[0] if len(chunks) == 1 else b"".join(chunks)
 
-    template = templates[0].template
-    template_image = ImageDownloader().download(template.blank)
-    prompt = ImageEditPromptGenerator().create_prompt(
-        user_description=description,
-        template=template,
-        template_image=template_image,
-        reference_image=ref_img,
-    )
 
-    print("\nPrompt:")
-    print(prompt)
+def _sniff(data: bytes) -> Optional[str]:
+    sig = data[:12]
+    if sig.startswith(b"\x89PNG"):
+        return "image/png"
+    if sig.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if sig[:4] == b"RIFF" and sig[8:12] == b"WEBP":
+        return "image/webp"
+    if sig.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    return None
+
+
+def _read_reference(path: str) -> DownloadedImage:
+    content = _slurp(path)
+    # The file's own signature wins over its extension
+    mime_type = _sniff(content) or mimetypes.guess_type(path)[0] or "image/png"
+    return DownloadedImage(url=path, content=content, mime_type=mime_type)
+
+
+async def _run(description: str, reference_image: Optional[str] = None):
+    # The reference read doesn't depend on the template, so it overlaps with picking and the download
+    ref_task = asyncio.create_task(asyncio.to_thread(_read_reference, reference_image)) if reference_image else None
+    generator = MemeImageGenerator()
+    # Open the connection to the model host while the template is picked and downloaded
+    warm_task = asyncio.create_task(generator.warm_up())
+
+    try:
+        templates = await _picker().pick_top_k(situation=description)
+
+        lines = ["\nPicked templates:"]
+        lines.extend(f"{t.score} {t.template}" for t in templates)
+        print("\n".join(lines))
+
+        template = templates[0].template
+        template_image = await CachedImageDownloader().download(template.blank)
+        ref_img = await ref_task if ref_task is not None else None
+        prompt = await ImageEditPromptGenerator().create_prompt(
+            user_description=description,
+            template=template,
+            template_image=template_image,
+            reference_image=ref_img,
+        )
+
+        print("\nPrompt:")
+        print(prompt)
+
+        await warm_task
+        res = await generator.generate(
+            prompt=prompt,
+            template_image=template_image,
+            reference_image=ref_img,
+        )
+    finally:
+        await _cancel_pending(ref_task, warm_task)
+
+    _save(res)
+    return res
+
+
+async def _cancel_pending(*tasks: Optional[asyncio.Task]) -> None:
+    # Background steps abandoned by a failure must finish before the caller closes the HTTP session
+    pending = [t for t in tasks if t is not None and not t.done()]
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
 
-    res = MemeImageGenerator().generate(
-        prompt=prompt,
-        template_image=template_image,
-        reference_image=ref_img,
-    )
 
+# Fixed instruction for the Stonks run below, so it needs neither the picker nor the prompt model
+_STONKS_PROMPT = (
+    "Edit this 'Stonks' meme: replace the man's face with the person from the reference image, matching the "
+    "original pose, lighting and art style. Keep the rising chart background and the 'STONKS' caption unchanged."
+)
+
+
+async def run_stonks(reference_image: str):
+    try:
+        return await _run_stonks(reference_image)
+    finally:
+        await close_session()
+
+
+async def _run_stonks(reference_image: str):
+    generator = MemeImageGenerator()
+    warm_task = asyncio.create_task(generator.warm_up())
+    ref_task = asyncio.create_task(asyncio.to_thread(_read_reference, reference_image))
+
+    try:
+        template = TemplateRepository().get("stonks")
+        if template is None:
+            raise RuntimeError("Stonks template not found")
+        template_image = await CachedImageDownloader().download(template.blank)
+        ref_img = await ref_task
+
+        await warm_task
+        res = await generator.generate(prompt=_STONKS_PROMPT, template_image=template_image, reference_image=ref_img)
+    finally:
+        await _cancel_pending(ref_task, warm_task)
+
+    _save(res)
+    return res
+
+
+def _save(res) -> None:
     print("\nImage generated!")
     with open("generated_image.png", "wb") as f:
         f.write(res.content)
 
-    return res
-
 
 if __name__ == "__main__":
-    res = test_run(
-        "Make a 'Stonks' meme image but use a person from the reference provided", reference_image="rhys.png"
-    )
+    res = asyncio.run(run_stonks(reference_image="rhys.png"))
+    # res = asyncio.run(
+    #     test_run("Make a 'Stonks' meme image but use a person from the reference provided", reference_image="rhys.png")
+    # )
     # res = test_run(
     #     "I am making a BI interface and have some free spaces with no charts, I want to put some meme there instead of a chart with the face of my client in it. Something representing success."
     # )